@@ -0,0 +1,257 @@
+"""Load test: feeds synthetic updates through the dispatcher against a stubbed Bot.
+
+    python bench.py --events 5000 --requests 2000 --concurrency 50
+    python bench.py time          # timeutil micro-benchmarks against the old helpers
+
+Runs in a temporary directory with its own genshin_bot.db, so the real
+database is never touched and nothing goes to the network.
+"""
+import argparse
+import asyncio
+import itertools
+import timeit
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARKbenchmarkBENCHMARKbench00")
+os.environ.setdefault("OWNER_ID", "1")
+os.environ.setdefault("TARGET_CHAT_ID", "-1001")
+os.chdir(tempfile.mkdtemp(prefix="sara-bench-"))
+
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+
+import sara
+import timeutil
+
+CHAT_ID = int(os.environ["TARGET_CHAT_ID"])
+OWNER_ID = int(os.environ["OWNER_ID"])
+
+
+class StubSession(BaseSession):
+    # يرد على كل طلب فورًا بكائن صالح بدل الاتصال بتيليجرام
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        name = type(method).__name__
+        if name == 'GetMe':
+            return types.User(id=123456, is_bot=True, first_name="bench")
+        if name == 'SendMediaGroup':
+            return [self._message(method)]
+        if name.startswith(('Send', 'Edit')):
+            return self._message(method)
+        return True
+
+    def _message(self, method):
+        chat_id = getattr(method, 'chat_id', None) or CHAT_ID
+        return types.Message(message_id=1, date=datetime.now(), chat=types.Chat(id=chat_id, type='supergroup'))
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+_ids = itertools.count(1)
+
+
+def make_update(text=None, user_id=OWNER_ID, photo=None):
+    message = dict(message_id=next(_ids), date=int(time.time()), chat=dict(id=CHAT_ID, type='supergroup'),
+                   from_user=dict(id=user_id, is_bot=False, first_name="u"))
+    if photo: message['photo'] = [dict(file_id=f"photo-{next(_ids)}", file_unique_id="u", width=1280, height=720)]
+    else: message['text'] = text
+    return types.Update(update_id=next(_ids), message=types.Message(**message))
+
+
+async def populate(events: int):
+    now = int(time.time())
+    sections = [(s, f"{s} title", "name", now + 86400 * 7, now + 86400 * 7 + 3600, now + 86400 * 7 + 7200, None, "photo-0")
+                for s in ('banner', 'stygian', 'spiral_abyss')]
+    rows = [(f"event {i}", now + 3600 * (2 + i % 500), f"description {i}") for i in range(events)]
+    await sara.db.bulk_import(0, sections, rows)
+    await sara.scheduler.load()
+
+
+async def set_banner_flow():
+    # مسار /setbanner كامل: كل خطوة تحديث مستقل
+    yield make_update("/setbanner")
+    yield make_update("Bench ; Banner")
+    for _ in range(3): yield make_update("2030-01-01 00:00:00")
+    yield make_update(photo=True)
+
+
+SCENARIOS = {
+    'read_banner': lambda: make_update("البنر"),
+    'read_events': lambda: make_update("الاحداث"),
+    'read_tower': lambda: make_update("/tower"),
+}
+
+
+async def timed(fn, samples):
+    start = time.perf_counter()
+    await fn()
+    samples.append(time.perf_counter() - start)
+
+
+async def run_reads(name, factory, requests, concurrency, samples, walls):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await timed(lambda: sara.dp.feed_update(sara.bot, factory()), samples[name])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    walls[name] = time.perf_counter() - start
+
+
+async def run_admin_flows(flows, samples, walls):
+    start = time.perf_counter()
+    for _ in range(flows):
+        async for update in set_banner_flow():
+            await timed(lambda: sara.dp.feed_update(sara.bot, update), samples['admin_set_step'])
+    walls['admin_set_step'] = time.perf_counter() - start
+
+
+async def run_alert_ticks(ticks, batch, samples, walls):
+    # كل دفعة تحاكي مواعيد مستحقة معًا، مع إرسال حقيقي عبر الجلسة الوهمية
+    rows = await sara.db.all_content()
+    start = time.perf_counter()
+    for tick in range(ticks):
+        due = [(0, row.id, 'europe', '1_hour_remaining', 0) for row in rows[tick * batch:(tick + 1) * batch]]
+        if not due: break
+        for entry in due: sara.scheduler._gen[entry[1]] = 0
+        await timed(lambda: _tick(due), samples['alert_tick'])
+    walls['alert_tick'] = time.perf_counter() - start
+
+
+async def _tick(due):
+    await sara.scheduler._fire_due(due)
+    while sara.scheduler._tasks:
+        await asyncio.gather(*list(sara.scheduler._tasks))
+
+
+def report(samples, walls, elapsed, session):
+    print(f"{'scenario':<16}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'ops/s':>10}")
+    for name, values in samples.items():
+        if not values: continue
+        values = sorted(values)
+        p50 = statistics.median(values) * 1000
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))] * 1000
+        print(f"{name:<16}{len(values):>8}{p50:>10.2f}{p99:>10.2f}{values[-1] * 1000:>10.2f}{len(values) / walls[name]:>10.0f}")
+    total = sum(len(v) for v in samples.values())
+    print(f"\n{total} updates/ticks in {elapsed:.2f}s ({total / elapsed:.0f}/s), {session.requests} stubbed API calls")
+
+
+# --- timeutil micro-benchmarks ---
+# النسخ السابقة من sara.py (strptime و datetime لكل استدعاء) كخط أساس للمقارنة
+
+def legacy_time_left_str(end_time: datetime, now: datetime) -> str:
+    total_seconds = int((end_time - now).total_seconds())
+    if total_seconds <= 0: return "منتهي"
+    return f"{total_seconds // 86400}يوم و {(total_seconds % 86400) // 3600}ساعة"
+
+
+def legacy_parse_end_datetime(date_time_str: str, offset_hours: int = 0):
+    try:
+        tz = timezone(timedelta(hours=offset_hours))
+        return datetime.strptime(date_time_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=tz).astimezone(timezone.utc)
+    except ValueError:
+        return None
+
+
+def run_time_benchmarks(rows: int, number: int):
+    now = time.time()
+    now_dt = datetime.fromtimestamp(now, timezone.utc)
+    ends = [int(now) + 3600 * (i % 500) + i for i in range(rows)]
+    end_dts = [datetime.fromtimestamp(e, timezone.utc) for e in ends]
+    texts = [datetime.fromtimestamp(e, timezone.utc).strftime("%Y-%m-%d %H:%M:%S") for e in ends]
+    fixed, berlin = timeutil.Zone(1), timeutil.Zone(name="Europe/Berlin")
+
+    class Row:
+        __slots__ = ('end_time_asia', 'end_time_europe', 'end_time_america')
+        def __init__(self, e): self.end_time_asia, self.end_time_europe, self.end_time_america = e, e + 3600, e + 7200
+
+    grid = [Row(e) for e in ends]
+    grid_dts = [[datetime.fromtimestamp(t, timezone.utc) for t in (r.end_time_asia, r.end_time_europe, r.end_time_america)]
+                for r in grid]
+
+    # المدخلات نصوص مختلفة، فذاكرة parse_wall تُفرغ قبل كل جولة لقياس التحليل نفسه
+    def parse_fast(zone):
+        timeutil.parse_wall.cache_clear()
+        for t in texts: timeutil.parse_local(t, zone)
+
+    cases = [
+        ("parse  strptime", lambda: [legacy_parse_end_datetime(t, 1) for t in texts]),
+        ("parse  fixed+1", lambda: parse_fast(fixed)),
+        ("parse  Europe/Berlin", lambda: parse_fast(berlin)),
+        ("parse  cached", lambda: [timeutil.parse_local(t, fixed) for t in texts]),
+        ("left   datetime", lambda: [legacy_time_left_str(e, now_dt) for e in end_dts]),
+        ("left   time_left_many", lambda: timeutil.time_left_many(ends, now)),
+        ("left3  datetime", lambda: [[legacy_time_left_str(e, now_dt) for e in r] for r in grid_dts]),
+        ("left3  time_left_rows", lambda: timeutil.time_left_rows(grid, now)),
+        ("format strftime", lambda: [datetime.fromtimestamp(e, timezone(timedelta(hours=1))).strftime("%Y-%m-%d %H:%M:%S") for e in ends]),
+        ("format Europe/Berlin", lambda: [timeutil.format_local(e, berlin) for e in ends]),
+    ]
+    print(f"{'case':<24}{'us/row':>10}   ({rows} rows, best of 5 x {number})")
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f"{name:<24}{best / rows * 1e6:>10.3f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", choices=["load", "time"], default="load")
+    parser.add_argument("--events", type=int, default=5000, help="events to preload")
+    parser.add_argument("--requests", type=int, default=2000, help="read updates per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--flows", type=int, default=20, help="full /setbanner flows")
+    parser.add_argument("--ticks", type=int, default=20, help="alert ticks")
+    parser.add_argument("--batch", type=int, default=50, help="alerts per tick")
+    parser.add_argument("--trace-memory", action="store_true", help="report Python heap peak (slower)")
+    parser.add_argument("--rows", type=int, default=1000, help="rows per micro-benchmark (time mode)")
+    args = parser.parse_args()
+
+    if args.mode == "time":
+        run_time_benchmarks(args.rows, number=20)
+        await sara.storage.close()
+        await sara.db.close()
+        return
+
+    # الجلسة الوهمية تستبدل جلسة البوت ومعها محدد المعدل، فالقياس لزمن المعالجة فقط
+    session = StubSession()
+    sara.bot.session = session
+    await populate(args.events)
+
+    if args.trace_memory: tracemalloc.start()
+    samples = {name: [] for name in [*SCENARIOS, 'admin_set_step', 'alert_tick']}
+    walls = {}
+    start = time.perf_counter()
+    for name, factory in SCENARIOS.items():
+        await run_reads(name, factory, args.requests, args.concurrency, samples, walls)
+    await run_admin_flows(args.flows, samples, walls)
+    await run_alert_ticks(args.ticks, args.batch, samples, walls)
+    elapsed = time.perf_counter() - start
+
+    report(samples, walls, elapsed, session)
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    if args.trace_memory:
+        print(f"peak Python heap: {tracemalloc.get_traced_memory()[1] / 2 ** 20:.1f} MiB")
+    await sara.scheduler.stop()
+    await sara.storage.close()
+    await sara.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
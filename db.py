@@ -0,0 +1,947 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import sqlite3
+import time
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from timeutil import Zone
+
+# الكتابات تُجمع وتُثبت (commit) دفعة واحدة بعد هذه المهلة أو عند امتلاء الدفعة
+COMMIT_DELAY = 0.05
+COMMIT_BATCH = 64
+
+logger = logging.getLogger("sara.db")
+
+DEFAULT_OFFSETS = {'asia': 8, 'europe': 1, 'america': -5}
+
+CONTENT_COLUMNS = "id, section, title, name, end_time_asia, end_time_europe, end_time_america, description, image_file_id, chat_id"
+
+
+class ContentRow(NamedTuple):
+    id: int
+    section: str
+    title: Optional[str]
+    name: Optional[str]
+    end_time_asia: Optional[int]
+    end_time_europe: Optional[int]
+    end_time_america: Optional[int]
+    description: Optional[str]
+    image_file_id: Optional[str]
+    chat_id: int
+
+
+class MediaRow(NamedTuple):
+    kind: str   # 'photo' أو 'card'
+    position: int
+    file_id: str
+    file_unique_id: Optional[str]
+    thumb_file_id: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+
+
+def _event_key(row):
+    return row.end_time_europe, row.id
+
+
+class Database:
+    # كل استعلامات SQLite تعمل على خيط (thread) واحد مخصص حتى لا تتوقف حلقة aiogram
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending = 0
+        self._commit_handle = None
+        self._flush_task: Optional[asyncio.Task] = None
+        # observer(op, seconds, result) يُستدعى بعد كل عملية، يُستخدم للقياسات
+        self.observer = None
+
+    # --- Executor plumbing ---
+
+    def _call(self, fn, *args):
+        return self._executor.submit(fn, *args).result()
+
+    async def _run(self, fn, *args, op: Optional[str] = None):
+        # op يسمي العملية في القياسات، وإلا يُستخدم اسم الدالة
+        if self.observer is None:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        result, seconds = await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, fn, args)
+        # observer يعمل على خيط الحلقة: القياسات تُقرأ هناك أيضًا (/metrics و /stats)
+        self.observer(op or getattr(fn, '__name__', 'sql').lstrip('_'), seconds, result)
+        return result
+
+    def _timed(self, fn, args):
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - start
+
+    async def _write(self, fn, *args, op: Optional[str] = None):
+        result = await self._run(fn, *args, op=op)
+        self._pending += 1
+        if self._pending >= COMMIT_BATCH:
+            await self.flush()
+        elif self._commit_handle is None:
+            self._commit_handle = asyncio.get_running_loop().call_later(COMMIT_DELAY, self._start_flush)
+        return result
+
+    def _start_flush(self):
+        # نحتفظ بالمهمة حتى لا تُجمع أثناء التنفيذ، ونسجل فشل الالتزام بدل أن يضيع
+        self._commit_handle = None
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("batched commit failed", exc_info=task.exception())
+
+    def _commit(self):
+        self._conn.commit()
+
+    @contextmanager
+    def _atomic(self, commit: bool = True):
+        # SAVEPOINT داخل معاملة الدفعة: فشل الكتلة يلغي عملها وحدها لا كتابات المعالجات الأخرى المنتظرة،
+        # ومع commit تُثبت الكتلة فورًا ومعها الدفعة
+        if not self._conn.in_transaction: self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute("SAVEPOINT atomic")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK TO atomic")
+            self._conn.execute("RELEASE atomic")
+            raise
+        self._conn.execute("RELEASE atomic")
+        if commit: self._conn.commit()
+
+    async def flush(self):
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        if not self._pending: return
+        self._pending = 0
+        await self._run(self._commit)
+
+    async def close(self):
+        if self._flush_task is not None: await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    # --- Setup ---
+
+    def _open(self, owner_id: int, default_chat_id: int):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        migrate(conn)
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("INSERT OR IGNORE INTO admins (chat_id, user_id) VALUES (0, ?)", (owner_id,))
+        conn.executemany("INSERT OR IGNORE INTO server_offsets (server, offset_hours) VALUES (?, ?)", DEFAULT_OFFSETS.items())
+        if default_chat_id:
+            conn.execute("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", (default_chat_id,))
+            # التنبيهات المسجلة قبل دعم عدة محادثات أُرسلت إلى TARGET_CHAT_ID
+            conn.execute("UPDATE OR IGNORE sent_alerts SET chat_id = ? WHERE chat_id = 0", (default_chat_id,))
+        conn.commit()
+        self._conn = conn
+
+    def open(self, owner_id: int, default_chat_id: int = 0):
+        self._call(self._open, owner_id, default_chat_id)
+
+    # --- Admins ---
+    # chat_id = 0 يعني مشرفًا عامًا على كل المحادثات
+
+    def _admin_ids(self):
+        return set(self._conn.execute("SELECT chat_id, user_id FROM admins").fetchall())
+
+    async def admin_ids(self) -> set[tuple[int, int]]:
+        return await self._run(self._admin_ids)
+
+    async def add_admin(self, user_id: int, chat_id: int = 0) -> None:
+        await self._write(self._conn.execute, "INSERT OR IGNORE INTO admins (chat_id, user_id) VALUES (?, ?)", (chat_id, user_id),
+                          op='add_admin')
+
+    async def remove_admin(self, user_id: int, chat_id: int = 0) -> None:
+        await self._write(self._conn.execute, "DELETE FROM admins WHERE chat_id = ? AND user_id = ?", (chat_id, user_id),
+                          op='remove_admin')
+
+    # --- Chats ---
+
+    def _subscribed_chats(self):
+        return {r[0] for r in self._conn.execute("SELECT chat_id FROM chats WHERE alerts_enabled = 1").fetchall()}
+
+    async def subscribed_chats(self) -> set[int]:
+        return await self._run(self._subscribed_chats)
+
+    async def set_subscription(self, chat_id: int, enabled: bool) -> None:
+        await self._write(self._conn.execute, """
+            INSERT INTO chats (chat_id, alerts_enabled) VALUES (?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET alerts_enabled = excluded.alerts_enabled
+        """, (chat_id, int(enabled)), op='set_subscription')
+
+    # --- Server offsets ---
+
+    def _get_zones(self):
+        return {server: (offset_hours or 0, tz_name) for server, offset_hours, tz_name
+                in self._conn.execute("SELECT server, offset_hours, tz_name FROM server_offsets").fetchall()}
+
+    async def get_zones(self) -> dict[str, tuple[int, Optional[str]]]:
+        return await self._run(self._get_zones)
+
+    async def set_zone(self, server: str, offset_hours: int, tz_name: Optional[str]) -> None:
+        await self._write(self._conn.execute, """
+            INSERT INTO server_offsets (server, offset_hours, tz_name) VALUES (?, ?, ?)
+            ON CONFLICT (server) DO UPDATE SET offset_hours = excluded.offset_hours, tz_name = excluded.tz_name
+        """, (server, offset_hours, tz_name), op='set_zone')
+
+    # --- Content ---
+    # chat_id = 0 محتوى عام يظهر في كل المحادثات، وغيره خاص بمحادثة واحدة
+
+    def _get_content(self, content_id):
+        row = self._conn.execute(f"SELECT {CONTENT_COLUMNS} FROM content WHERE id = ?", (content_id,)).fetchone()
+        return ContentRow(*row) if row else None
+
+    async def get_content(self, content_id: int) -> Optional[ContentRow]:
+        return await self._run(self._get_content, content_id)
+
+    def _all_content(self):
+        return [ContentRow(*r) for r in self._conn.execute(f"SELECT {CONTENT_COLUMNS} FROM content").fetchall()]
+
+    async def all_content(self) -> list[ContentRow]:
+        return await self._run(self._all_content)
+
+    def _get_section(self, chat_id, section):
+        row = self._conn.execute(f"SELECT {CONTENT_COLUMNS} FROM content WHERE chat_id = ? AND section = ?",
+                                 (chat_id, section)).fetchone()
+        return ContentRow(*row) if row else None
+
+    async def get_section(self, chat_id: int, section: str) -> Optional[ContentRow]:
+        return await self._run(self._get_section, chat_id, section)
+
+    def _upsert_section(self, chat_id, section, title, name, end_time_asia, end_time_europe, end_time_america, file_id, media):
+        with self._atomic(commit=False):
+            existing_row = self._conn.execute("SELECT id FROM content WHERE chat_id = ? AND section = ?", (chat_id, section)).fetchone()
+            if existing_row:
+                content_id = existing_row[0]
+                self._conn.execute("""
+                    UPDATE content SET title=?, name=?, end_time_asia=?, end_time_europe=?, end_time_america=?, image_file_id=?
+                    WHERE id=?
+                """, (title, name, end_time_asia, end_time_europe, end_time_america, file_id, content_id))
+                self._conn.execute("DELETE FROM sent_alerts WHERE content_id = ?", (content_id,))
+                self._conn.execute("DELETE FROM content_media WHERE content_id = ?", (content_id,))
+            else:
+                content_id = self._conn.execute("""
+                    INSERT INTO content (chat_id, section, title, name, end_time_asia, end_time_europe, end_time_america, image_file_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (chat_id, section, title, name, end_time_asia, end_time_europe, end_time_america, file_id)).lastrowid
+            self._conn.executemany("""
+                INSERT INTO content_media (content_id, kind, position, file_id, file_unique_id, thumb_file_id, width, height)
+                VALUES (?, 'photo', ?, ?, ?, ?, ?, ?)
+            """, [(content_id, position, *item) for position, item in enumerate(media)])
+            return content_id
+
+    async def upsert_section(self, chat_id: int, section: str, title: Optional[str], name: Optional[str], end_time_asia: int,
+                             end_time_europe: int, end_time_america: int, file_id: str,
+                             media: list[tuple[str, str, str, int, int]] = ()) -> int:
+        # media: (file_id, file_unique_id, thumb_file_id, width, height) لكل صورة في الألبوم
+        return await self._write(self._upsert_section, chat_id, section, title, name,
+                                 end_time_asia, end_time_europe, end_time_america, file_id, list(media))
+
+    def _get_media(self, content_id):
+        return [MediaRow(*r) for r in self._conn.execute("""
+            SELECT kind, position, file_id, file_unique_id, thumb_file_id, width, height
+            FROM content_media WHERE content_id = ? ORDER BY kind, position
+        """, (content_id,)).fetchall()]
+
+    async def get_media(self, content_id: int) -> list[MediaRow]:
+        return await self._run(self._get_media, content_id)
+
+    async def set_card(self, content_id: int, file_id: str) -> None:
+        # البطاقة المجمعة تُرفع مرة واحدة ويُحفظ file_id الناتج
+        await self._write(self._conn.execute, """
+            INSERT INTO content_media (content_id, kind, position, file_id) VALUES (?, 'card', 0, ?)
+            ON CONFLICT (content_id, kind, position) DO UPDATE SET file_id = excluded.file_id
+        """, (content_id, file_id), op='set_card')
+
+    def _add_event(self, chat_id, name, end_time_europe, description):
+        return self._conn.execute("""
+            INSERT INTO content (chat_id, section, name, end_time_europe, description)
+            VALUES (?, ?, ?, ?, ?)
+        """, (chat_id, 'events', name, end_time_europe, description)).lastrowid
+
+    async def add_event(self, chat_id: int, name: str, end_time_europe: int, description: str) -> int:
+        return await self._write(self._add_event, chat_id, name, end_time_europe, description)
+
+    # صفحات الأحداث بترتيب وقت الانتهاء: المؤشر (end_time_europe, id) لآخر/أول صف معروض،
+    # فكل صفحة قراءة بالفهرس idx_content_chat_section بحجم الصفحة مهما كثرت الأحداث
+
+    def _events_after(self, chat_ids, key, limit):
+        pages = [[ContentRow(*r) for r in self._conn.execute(f"""
+            SELECT {CONTENT_COLUMNS} FROM content
+            WHERE chat_id = ? AND section = 'events' AND (end_time_europe, id) > (?, ?)
+            ORDER BY end_time_europe, id LIMIT ?
+        """, (chat_id, *key, limit)).fetchall()] for chat_id in chat_ids]
+        return list(itertools.islice(heapq.merge(*pages, key=_event_key), limit))
+
+    async def events_after(self, chat_id: int, key: tuple[int, int], limit: int) -> list[ContentRow]:
+        # أحداث النطاق العام ونطاق المحادثة معًا
+        return await self._run(self._events_after, sorted({0, chat_id}), key, limit)
+
+    def _events_before(self, chat_ids, key, floor, limit):
+        pages = [[ContentRow(*r) for r in self._conn.execute(f"""
+            SELECT {CONTENT_COLUMNS} FROM content
+            WHERE chat_id = ? AND section = 'events' AND (end_time_europe, id) < (?, ?) AND end_time_europe > ?
+            ORDER BY end_time_europe DESC, id DESC LIMIT ?
+        """, (chat_id, *key, floor, limit)).fetchall()] for chat_id in chat_ids]
+        return list(itertools.islice(heapq.merge(*pages, key=_event_key, reverse=True), limit))[::-1]
+
+    async def events_before(self, chat_id: int, key: tuple[int, int], floor: int, limit: int) -> list[ContentRow]:
+        return await self._run(self._events_before, sorted({0, chat_id}), key, floor, limit)
+
+    def _delete_content_ids(self, ids):
+        # sent_alerts تُحذف تلقائيًا (ON DELETE CASCADE)
+        self._conn.executemany("DELETE FROM content WHERE id = ?", [(i,) for i in ids])
+        return ids
+
+    def _delete_events(self, chat_id):
+        ids = [r[0] for r in self._conn.execute(
+            "SELECT id FROM content WHERE chat_id = ? AND section='events'", (chat_id,)).fetchall()]
+        return self._delete_content_ids(ids)
+
+    async def delete_events(self, chat_id: int) -> list[int]:
+        return await self._write(self._delete_events, chat_id)
+
+    def _bulk_import(self, chat_id, sections, events):
+        # معاملة واحدة: إما أن تُستورد كل الصفوف أو لا شيء
+        with self._atomic():
+            self._conn.executemany("""
+                UPDATE content SET title=?, name=?, end_time_asia=?, end_time_europe=?, end_time_america=?,
+                                   description=?, image_file_id=COALESCE(?, image_file_id)
+                WHERE chat_id=? AND section=?
+            """, [(*row[1:], chat_id, row[0]) for row in sections])
+            self._conn.executemany("""
+                INSERT INTO content (chat_id, section, title, name, end_time_asia, end_time_europe, end_time_america, description, image_file_id)
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM content WHERE chat_id = ? AND section = ?)
+            """, [(chat_id, *row, chat_id, row[0]) for row in sections])
+            marks = ",".join("?" * len(sections))
+            section_ids = [r[0] for r in self._conn.execute(
+                f"SELECT id FROM content WHERE chat_id = ? AND section IN ({marks})", (chat_id, *(r[0] for r in sections))).fetchall()]
+            self._conn.executemany("DELETE FROM sent_alerts WHERE content_id = ?", [(i,) for i in section_ids])
+            # الصورة المستوردة تحل محل ألبوم القسم السابق
+            self._conn.executemany("DELETE FROM content_media WHERE content_id = ?", [(i,) for i in section_ids])
+            first_event = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM content").fetchone()[0]
+            self._conn.executemany("""
+                INSERT INTO content (chat_id, section, name, end_time_europe, description)
+                VALUES (?, 'events', ?, ?, ?)
+            """, [(chat_id, *row) for row in events])
+            event_ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM content WHERE chat_id = ? AND section = 'events' AND id > ?", (chat_id, first_event)).fetchall()]
+        return section_ids + event_ids
+
+    async def bulk_import(self, chat_id: int, sections: list[tuple], events: list[tuple[str, int, str]]) -> list[int]:
+        return await self._run(self._bulk_import, chat_id, sections, events)
+
+    def _export_page(self, chat_id, after_id, limit):
+        return [ContentRow(*r) for r in self._conn.execute(
+            f"SELECT {CONTENT_COLUMNS} FROM content WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (chat_id, after_id, limit)).fetchall()]
+
+    async def export_page(self, chat_id: int, after_id: int, limit: int) -> list[ContentRow]:
+        return await self._run(self._export_page, chat_id, after_id, limit)
+
+    def _content_version(self):
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'content_version'").fetchone()[0]
+
+    async def content_version(self) -> int:
+        return await self._run(self._content_version)
+
+    # --- Sent alerts ---
+
+    def _sent_alerts(self, content_id):
+        # الحجوزات ليست إرسالًا: يحسمها claim_alerts عند الإطلاق
+        if content_id is None:
+            return set(self._conn.execute(
+                "SELECT content_id, chat_id, server, alert_type FROM sent_alerts WHERE status = 'sent'").fetchall())
+        return set(self._conn.execute(
+            "SELECT content_id, chat_id, server, alert_type FROM sent_alerts WHERE content_id = ? AND status = 'sent'",
+            (content_id,)).fetchall())
+
+    async def sent_alerts(self, content_id: Optional[int] = None) -> set[tuple[int, int, str, str]]:
+        return await self._run(self._sent_alerts, content_id)
+
+    def _alert_batch(self, content_ids):
+        # قراءة واحدة لكل دفعة تنبيهات مستحقة: الصفوف وما أُرسل منها لكل محادثة
+        marks = ",".join("?" * len(content_ids))
+        rows = {r[0]: ContentRow(*r) for r in self._conn.execute(
+            f"SELECT {CONTENT_COLUMNS} FROM content WHERE id IN ({marks})", content_ids).fetchall()}
+        sent = set(self._conn.execute(
+            f"SELECT content_id, chat_id, server, alert_type FROM sent_alerts WHERE content_id IN ({marks}) AND status = 'sent'",
+            content_ids).fetchall())
+        # المحادثات التي لها صف خاص بقسم عام في الدفعة: تقرأ صفها فلا تُنبه بالعام
+        sections = sorted({row.section for row in rows.values() if row.chat_id == 0 and row.section != 'events'})
+        overrides = {section: set() for section in sections}
+        if sections:
+            for section, chat_id in self._conn.execute(
+                    f"SELECT section, chat_id FROM content WHERE chat_id != 0 AND section IN ({','.join('?' * len(sections))})",
+                    sections).fetchall():
+                overrides[section].add(chat_id)
+        return rows, sent, overrides
+
+    async def alert_batch(self, content_ids: list[int]) -> tuple[dict[int, ContentRow], set[tuple[int, int, str, str]],
+                                                                 dict[str, set[int]]]:
+        return await self._run(self._alert_batch, list(content_ids))
+
+    def _claim_alerts(self, marks, holder, stale_before):
+        # الحجز يسبق الإرسال: صف واحد لكل تنبيه ومحادثة، فمن يدرجه أولاً هو وحده من يرسل.
+        # حجز أقدم من stale_before تركته عملية توقفت قبل إنهاء الإرسال، فيُستعاد
+        now, claimed, pending = int(time.time()), [], []
+        for mark in marks:
+            try:
+                cursor = self._conn.execute("""
+                    INSERT INTO sent_alerts (content_id, chat_id, server, alert_type, status, claimed_by, claimed_at)
+                    VALUES (?, ?, ?, ?, 'claimed', ?, ?)
+                    ON CONFLICT (content_id, chat_id, server, alert_type) DO UPDATE
+                    SET claimed_by = excluded.claimed_by, claimed_at = excluded.claimed_at
+                    WHERE sent_alerts.status = 'claimed' AND sent_alerts.claimed_at < ?
+                """, (*mark, holder, now, stale_before))
+            except sqlite3.IntegrityError:
+                continue   # المحتوى حُذف
+            if cursor.rowcount:
+                claimed.append(mark)
+            elif self._conn.execute("""
+                SELECT status FROM sent_alerts WHERE content_id = ? AND chat_id = ? AND server = ? AND alert_type = ?
+            """, mark).fetchone()[0] == 'claimed':
+                pending.append(mark)
+        self._conn.commit()
+        return claimed, pending
+
+    async def claim_alerts(self, marks: list[tuple[int, int, str, str]], holder: str,
+                           stale_before: float) -> tuple[list[tuple[int, int, str, str]], list[tuple[int, int, str, str]]]:
+        # (المحجوز لنا، المحجوز حديثًا لعملية أخرى)
+        return await self._run(self._claim_alerts, marks, holder, stale_before)
+
+    def _finish_alert_claims(self, sent, failed):
+        self._conn.executemany("""
+            UPDATE sent_alerts SET status = 'sent'
+            WHERE content_id = ? AND chat_id = ? AND server = ? AND alert_type = ?
+        """, sent)
+        # الفاشل يُحرر ليُحجز من جديد عند إعادة المحاولة
+        self._conn.executemany("""
+            DELETE FROM sent_alerts
+            WHERE content_id = ? AND chat_id = ? AND server = ? AND alert_type = ? AND status = 'claimed'
+        """, failed)
+
+    async def finish_alert_claims(self, sent: list[tuple[int, int, str, str]], failed: list[tuple[int, int, str, str]]) -> None:
+        await self._write(self._finish_alert_claims, sent, failed)
+
+    def _release_alert_claims(self, holder):
+        self._conn.execute("DELETE FROM sent_alerts WHERE status = 'claimed' AND claimed_by = ?", (holder,))
+        self._conn.commit()
+
+    async def release_alert_claims(self, holder: str) -> None:
+        # عند التوقف: إرسال أُلغي قبل تأكيده يعود متاحًا للقائد التالي فورًا
+        await self._run(self._release_alert_claims, holder)
+
+    # --- Leases ---
+    # إيجار باسم مهمة: صاحبه يجدده قبل انتهائه، وبعد انتهائه تستولي عليه أي عملية أخرى
+
+    def _acquire_lease(self, name, holder, ttl):
+        now = time.time()
+        cursor = self._conn.execute("""
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        """, (name, holder, now + ttl, now))
+        self._conn.commit()
+        return cursor.rowcount == 1
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        return await self._run(self._acquire_lease, name, holder, ttl)
+
+    def _release_lease(self, name, holder):
+        self._conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+        self._conn.commit()
+
+    async def release_lease(self, name: str, holder: str) -> None:
+        await self._run(self._release_lease, name, holder)
+
+    def _data_version(self):
+        # يتغير فقط عندما تثبت اتصالات أخرى (عمليات أخرى) تعديلات على الملف
+        return (self._conn.execute("PRAGMA data_version").fetchone()[0],
+                self._conn.execute("SELECT value FROM meta WHERE key = 'content_version'").fetchone()[0])
+
+    async def data_version(self) -> tuple[int, int]:
+        return await self._run(self._data_version)
+
+    # --- Album parts ---
+    # أجزاء الألبوم قد تصل لعمليات مختلفة، فتُجمع في قاعدة البيانات وتُلتزم فورًا
+
+    def _add_album_part(self, group_id, message_id, sizes):
+        with self._atomic():
+            self._conn.execute("""
+                INSERT OR REPLACE INTO album_parts (media_group_id, message_id, sizes, received_at) VALUES (?, ?, ?, ?)
+            """, (group_id, message_id, sizes, time.time()))
+
+    async def add_album_part(self, group_id: str, message_id: int, sizes: str) -> None:
+        await self._run(self._add_album_part, group_id, message_id, sizes)
+
+    def _take_album(self, group_id, quiet_since):
+        with self._atomic():
+            if self._conn.execute("SELECT MAX(received_at) > ? FROM album_parts WHERE media_group_id = ?",
+                                  (quiet_since, group_id)).fetchone()[0]:
+                return None
+            rows = self._conn.execute("DELETE FROM album_parts WHERE media_group_id = ? RETURNING message_id, sizes",
+                                      (group_id,)).fetchall()
+        return [sizes for _, sizes in sorted(rows)]
+
+    async def take_album(self, group_id: str, quiet_since: float) -> Optional[list[str]]:
+        # None: وصل جزء بعد quiet_since فالألبوم لم يكتمل بعد. [] : أخذته عملية أخرى
+        return await self._run(self._take_album, group_id, quiet_since)
+
+    # --- Recurrences ---
+    # قاعدة تكرار لكل قسم، وأوقات الدورة الحالية تُحفظ في صف المحتوى نفسه فالقراءة لا تحسب شيئًا
+
+    def _recurrences(self, chat_id):
+        if chat_id is None:
+            return self._conn.execute("""
+                SELECT c.id, r.rule FROM recurrences r JOIN content c ON c.chat_id = r.chat_id AND c.section = r.section
+            """).fetchall()
+        return self._conn.execute("SELECT section, rule FROM recurrences WHERE chat_id = ? ORDER BY section", (chat_id,)).fetchall()
+
+    async def recurrences(self, chat_id: Optional[int] = None) -> list[tuple]:
+        # بلا chat_id: (content_id, rule) لكل القواعد، وإلا (section, rule) لمحادثة واحدة
+        return await self._run(self._recurrences, chat_id)
+
+    async def set_recurrence(self, chat_id: int, section: str, rule: Optional[str]) -> None:
+        if rule is None:
+            await self._write(self._conn.execute, "DELETE FROM recurrences WHERE chat_id = ? AND section = ?", (chat_id, section),
+                              op='set_recurrence')
+            return
+        await self._write(self._conn.execute, """
+            INSERT INTO recurrences (chat_id, section, rule) VALUES (?, ?, ?)
+            ON CONFLICT (chat_id, section) DO UPDATE SET rule = excluded.rule
+        """, (chat_id, section, rule), op='set_recurrence')
+
+    def _set_end_times(self, content_id, ends):
+        with self._atomic(commit=False):
+            for server, end_ts in ends.items():
+                self._conn.execute(f"UPDATE content SET end_time_{server} = ? WHERE id = ?", (end_ts, content_id))
+                # دورة جديدة: تنبيهات هذا السيرفر تُرسل من جديد
+                self._conn.execute("DELETE FROM sent_alerts WHERE content_id = ? AND server = ?", (content_id, server))
+
+    async def set_end_times(self, content_id: int, ends: dict[str, int]) -> None:
+        await self._write(self._set_end_times, content_id, {s: ends[s] for s in ('asia', 'europe', 'america') if s in ends})
+
+    # --- Maintenance ---
+    # كل دفعة معاملة قصيرة مستقلة، فلا يطول قفل الكتابة على العمليات الأخرى
+
+    def _purge_expired_events(self, before, limit):
+        with self._atomic():
+            return self._conn.execute("""
+                DELETE FROM content WHERE id IN (
+                    SELECT id FROM content WHERE section = 'events' AND end_time_europe < ? LIMIT ?
+                ) RETURNING id, chat_id
+            """, (before, limit)).fetchall()
+
+    async def purge_expired_events(self, before: int, limit: int) -> list[tuple[int, int]]:
+        return await self._run(self._purge_expired_events, before, limit)
+
+    def _purge_orphans(self, limit):
+        # صفوف بقيت من كتابات سابقة للمفاتيح الأجنبية أو بدونها
+        with self._atomic():
+            count = 0
+            for table in ('sent_alerts', 'content_media'):
+                count += self._conn.execute(f"""
+                    DELETE FROM {table} WHERE rowid IN (
+                        SELECT t.rowid FROM {table} t LEFT JOIN content c ON c.id = t.content_id
+                        WHERE c.id IS NULL LIMIT ?
+                    )
+                """, (limit,)).rowcount
+            # أجزاء ألبوم توقفت عمليتها قبل حفظه
+            count += self._conn.execute("DELETE FROM album_parts WHERE received_at < ?", (time.time() - 3600,)).rowcount
+            return count
+
+    async def purge_orphans(self, limit: int) -> int:
+        return await self._run(self._purge_orphans, limit)
+
+    def _checkpoint(self):
+        return self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+
+    async def checkpoint(self) -> tuple[int, int, int]:
+        await self.flush()
+        return await self._run(self._checkpoint)
+
+    async def optimize(self) -> None:
+        # ANALYZE عند الحاجة فقط للجداول التي تغيرت كثيرًا
+        await self._run(self._conn.execute, "PRAGMA optimize", op='optimize')
+
+    def _vacuum(self, min_free_ratio):
+        pages = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        free = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not pages or free / pages < min_free_ratio: return False
+        self._conn.commit()
+        self._conn.execute("VACUUM")
+        return True
+
+    async def vacuum(self, min_free_ratio: float) -> bool:
+        await self.flush()
+        return await self._run(self._vacuum, min_free_ratio)
+
+    # --- FSM states ---
+
+    def _load_fsm_state(self, key, min_updated_at):
+        return self._conn.execute("SELECT state, data, updated_at FROM fsm_states WHERE key = ? AND updated_at >= ?",
+                                  (key, min_updated_at)).fetchone()
+
+    async def load_fsm_state(self, key: str, min_updated_at: int) -> Optional[tuple[Optional[str], str, int]]:
+        return await self._run(self._load_fsm_state, key, min_updated_at)
+
+    def _save_fsm_states(self, upserts, deletes):
+        self._conn.executemany("""
+            INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+        """, upserts)
+        self._conn.executemany("DELETE FROM fsm_states WHERE key = ?", [(k,) for k in deletes])
+
+    async def save_fsm_states(self, upserts: list[tuple[str, Optional[str], str, int]], deletes: list[str]) -> None:
+        await self._write(self._save_fsm_states, upserts, deletes)
+
+    def _purge_fsm_states(self, before):
+        return self._conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,)).rowcount
+
+    async def purge_fsm_states(self, before: int) -> int:
+        return await self._write(self._purge_fsm_states, before)
+
+
+# --- Schema migrations ---
+# كل ترحيل يرفع PRAGMA user_version بواحد، ويُطبق داخل معاملة مستقلة عند التشغيل
+
+def _migration_1_base_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS admins (
+        user_id INTEGER PRIMARY KEY
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS content (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        section TEXT,
+        title TEXT,
+        name TEXT,
+        end_time_asia TEXT,
+        end_time_europe TEXT,
+        end_time_america TEXT,
+        description TEXT,
+        image_file_id TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS server_offsets (
+        server TEXT PRIMARY KEY,
+        offset_hours INTEGER
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sent_alerts (
+        content_id INTEGER,
+        server TEXT,
+        alert_type TEXT,
+        PRIMARY KEY (content_id, server, alert_type)
+    )
+    """)
+
+
+def _migration_2_epoch_end_times(conn):
+    # أوقات الانتهاء تتحول من نص "YYYY-MM-DD HH:MM:SS" (UTC) إلى ثوانٍ epoch صحيحة
+    conn.execute("""
+    CREATE TABLE content_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        section TEXT,
+        title TEXT,
+        name TEXT,
+        end_time_asia INTEGER,
+        end_time_europe INTEGER,
+        end_time_america INTEGER,
+        description TEXT,
+        image_file_id TEXT
+    )
+    """)
+    conn.execute("""
+    INSERT INTO content_new (id, section, title, name, end_time_asia, end_time_europe, end_time_america, description, image_file_id)
+    SELECT id, section, title, name,
+           CAST(strftime('%s', end_time_asia) AS INTEGER),
+           CAST(strftime('%s', end_time_europe) AS INTEGER),
+           CAST(strftime('%s', end_time_america) AS INTEGER),
+           description, image_file_id
+    FROM content
+    """)
+    conn.execute("DROP TABLE content")
+    conn.execute("ALTER TABLE content_new RENAME TO content")
+    conn.execute("CREATE INDEX idx_content_section ON content (section)")
+    conn.execute("CREATE INDEX idx_content_section_europe ON content (section, end_time_europe)")
+
+    conn.execute("""
+    CREATE TABLE sent_alerts_new (
+        content_id INTEGER NOT NULL REFERENCES content (id) ON DELETE CASCADE,
+        server TEXT NOT NULL,
+        alert_type TEXT NOT NULL,
+        PRIMARY KEY (content_id, server, alert_type)
+    )
+    """)
+    conn.execute("""
+    INSERT INTO sent_alerts_new (content_id, server, alert_type)
+    SELECT content_id, server, alert_type FROM sent_alerts WHERE content_id IN (SELECT id FROM content)
+    """)
+    conn.execute("DROP TABLE sent_alerts")
+    conn.execute("ALTER TABLE sent_alerts_new RENAME TO sent_alerts")
+
+    # عداد يزيد مع كل تعديل على content، حتى من عمليات أخرى تشارك نفس الملف
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("INSERT INTO meta (key, value) VALUES ('content_version', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+        CREATE TRIGGER content_version_{event.lower()} AFTER {event} ON content
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'content_version';
+        END
+        """)
+
+
+def _migration_3_fsm_states(conn):
+    conn.execute("""
+    CREATE TABLE fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_fsm_states_updated ON fsm_states (updated_at)")
+
+
+def _migration_4_multi_chat(conn):
+    conn.execute("ALTER TABLE content ADD COLUMN chat_id INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX idx_content_chat_section ON content (chat_id, section, end_time_europe)")
+
+    conn.execute("""
+    CREATE TABLE admins_new (
+        chat_id INTEGER NOT NULL DEFAULT 0,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    )
+    """)
+    conn.execute("INSERT INTO admins_new (chat_id, user_id) SELECT 0, user_id FROM admins")
+    conn.execute("DROP TABLE admins")
+    conn.execute("ALTER TABLE admins_new RENAME TO admins")
+
+    conn.execute("""
+    CREATE TABLE sent_alerts_new (
+        content_id INTEGER NOT NULL REFERENCES content (id) ON DELETE CASCADE,
+        chat_id INTEGER NOT NULL DEFAULT 0,
+        server TEXT NOT NULL,
+        alert_type TEXT NOT NULL,
+        PRIMARY KEY (content_id, chat_id, server, alert_type)
+    )
+    """)
+    conn.execute("INSERT INTO sent_alerts_new (content_id, server, alert_type) SELECT content_id, server, alert_type FROM sent_alerts")
+    conn.execute("DROP TABLE sent_alerts")
+    conn.execute("ALTER TABLE sent_alerts_new RENAME TO sent_alerts")
+
+    conn.execute("""
+    CREATE TABLE chats (
+        chat_id INTEGER PRIMARY KEY,
+        alerts_enabled INTEGER NOT NULL DEFAULT 1
+    )
+    """)
+
+
+def _migration_5_leases_and_claims(conn):
+    conn.execute("""
+    CREATE TABLE leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+    # الصفوف السابقة أُرسلت فعلًا؛ الجديدة تبدأ 'claimed' وتصبح 'sent' بعد نجاح الإرسال
+    conn.execute("ALTER TABLE sent_alerts ADD COLUMN status TEXT NOT NULL DEFAULT 'sent'")
+    conn.execute("ALTER TABLE sent_alerts ADD COLUMN claimed_by TEXT")
+    conn.execute("ALTER TABLE sent_alerts ADD COLUMN claimed_at INTEGER")
+
+
+def _migration_6_zone_names(conn):
+    # اسم منطقة IANA (مثل Europe/Berlin) يغلب offset_hours عند تحديده
+    conn.execute("ALTER TABLE server_offsets ADD COLUMN tz_name TEXT")
+
+
+def _migration_7_content_media(conn):
+    # صور الألبوم لكل قسم؛ image_file_id يبقى أول صورة (وهو ما يستخدمه الاستيراد والتصدير)
+    conn.execute("""
+    CREATE TABLE content_media (
+        content_id INTEGER NOT NULL REFERENCES content (id) ON DELETE CASCADE,
+        kind TEXT NOT NULL DEFAULT 'photo',
+        position INTEGER NOT NULL,
+        file_id TEXT NOT NULL,
+        file_unique_id TEXT,
+        thumb_file_id TEXT,
+        width INTEGER,
+        height INTEGER,
+        PRIMARY KEY (content_id, kind, position)
+    )
+    """)
+
+
+def _migration_8_recurrences(conn):
+    conn.execute("""
+    CREATE TABLE recurrences (
+        chat_id INTEGER NOT NULL DEFAULT 0,
+        section TEXT NOT NULL,
+        rule TEXT NOT NULL,
+        PRIMARY KEY (chat_id, section)
+    )
+    """)
+    # تغيير القواعد يعيد تحميل جدول التنبيهات عند القائد كتعديل المحتوى
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+        CREATE TRIGGER recurrences_version_{event.lower()} AFTER {event} ON recurrences
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'content_version';
+        END
+        """)
+
+
+def _migration_9_album_parts(conn):
+    conn.execute("""
+    CREATE TABLE album_parts (
+        media_group_id TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        sizes TEXT NOT NULL,
+        received_at REAL NOT NULL,
+        PRIMARY KEY (media_group_id, message_id)
+    )
+    """)
+
+
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_epoch_end_times,
+    _migration_3_fsm_states,
+    _migration_4_multi_chat,
+    _migration_5_leases_and_claims,
+    _migration_6_zone_names,
+    _migration_7_content_media,
+    _migration_8_recurrences,
+    _migration_9_album_parts,
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    # إعادة بناء الجداول تتطلب تعطيل المفاتيح الأجنبية خارج المعاملة
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            # عملية أخرى بدأت معنا قد تكون طبقت الترحيل قبل حصولنا على القفل
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                conn.execute("ROLLBACK")
+                version = number
+                continue
+            try:
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+            version = number
+    finally:
+        conn.isolation_level = isolation_level
+    return version
+
+
+# --- Read-through cache ---
+
+_MISSING = object()
+
+
+class Cache:
+    # نسخة في الذاكرة من المشرفين والإزاحات والمحتوى، تُبطل عند كل تعديل
+    def __init__(self, db: Database):
+        self.db = db
+        self.hits = Counter()
+        self.misses = Counter()
+        self._values = {}
+        self._gens = Counter()
+        # يزيد مع كل إبطال شامل للمحتوى، فيغير نسخة المفاتيح التي لم تُحمّل في الذاكرة قط (مثل الأحداث)
+        self._epoch = 0
+
+    async def _get(self, key, loader):
+        value = self._values.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits[key[0]] += 1
+            return value
+        self.misses[key[0]] += 1
+        gen = self._gens[key]
+        value = await loader()
+        # لا نخزن نتيجة قُرئت قبل إبطال حدث أثناء القراءة
+        if self._gens[key] == gen: self._values[key] = value
+        return value
+
+    def _invalidate(self, key):
+        self._gens[key] += 1
+        self._values.pop(key, None)
+
+    async def is_admin(self, user_id: int, chat_id: int = 0) -> bool:
+        admins = await self._get(('admins',), self.db.admin_ids)
+        return (0, user_id) in admins or (chat_id, user_id) in admins
+
+    async def subscribed_chats(self) -> set[int]:
+        return await self._get(('chats',), self.db.subscribed_chats)
+
+    async def zones(self) -> dict[str, Zone]:
+        async def load():
+            return {server: Zone(offset_hours, tz_name) for server, (offset_hours, tz_name) in (await self.db.get_zones()).items()}
+        return await self._get(('zones',), load)
+
+    def _key(self, chat_id, section):
+        return ('events', chat_id) if section == 'events' else ('section', chat_id, section)
+
+    async def _scoped_section(self, chat_id, section):
+        return await self._get(self._key(chat_id, section), lambda: self.db.get_section(chat_id, section))
+
+    async def section(self, chat_id: int, section: str) -> Optional[ContentRow]:
+        # محتوى المحادثة إن وجد، وإلا المحتوى العام
+        row = await self._scoped_section(chat_id, section) if chat_id else None
+        return row or await self._scoped_section(0, section)
+
+    def invalidate_admins(self):
+        self._invalidate(('admins',))
+
+    def invalidate_chats(self):
+        self._invalidate(('chats',))
+
+    def invalidate_zones(self):
+        self._invalidate(('zones',))
+
+    def invalidate_section(self, chat_id: int, section: str):
+        self._invalidate(self._key(chat_id, section))
+
+    def invalidate_all(self, content: bool = True):
+        # تعديل من عملية أخرى: لا نعرف ما تغير، فنبطل كل ما في الذاكرة
+        for key in set(self._values) | set(self._gens):
+            if content or key[0] not in ('section', 'events'): self._invalidate(key)
+        if content: self._epoch += 1
+
+    def version(self, chat_id: int, section: str) -> tuple[int, int, int]:
+        # يتغير مع كل إبطال للنطاق العام أو نطاق المحادثة، ويُستخدم مفتاحًا لنسخ العرض الجاهزة
+        return self._epoch, self._gens[self._key(0, section)], self._gens[self._key(chat_id, section)]
+
+    def stats(self) -> dict[str, tuple[int, int]]:
+        return {k: (self.hits[k], self.misses[k]) for k in sorted(set(self.hits) | set(self.misses))}
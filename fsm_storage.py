@@ -0,0 +1,128 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from typing import Any, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from db import Database
+
+# جلسة لم تتغير منذ يوم كامل تعتبر مهجورة
+FSM_TTL = 24 * 3600
+FLUSH_INTERVAL = 1.0
+SWEEP_INTERVAL = 600
+
+logger = logging.getLogger("sara.fsm")
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'updated_at')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[dict] = None, updated_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    # نسخة في الذاكرة أمام جدول fsm_states: القراءة والكتابة فورية، والحفظ على القرص دفعات
+    # shared=True عند تشغيل عدة عمليات: تحديثات المستخدم قد تصل لأي عملية، فلا نثق بالنسخة
+    # في الذاكرة ونكتب فورًا
+    def __init__(self, db: Database, ttl: int = FSM_TTL, flush_interval: float = FLUSH_INTERVAL, shared: bool = False):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._front: dict[str, _Record] = {}
+        self._dirty: set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    async def _record(self, key: StorageKey) -> tuple[str, _Record]:
+        # التنظيف الدوري مستقل عن الكتابة، فيعمل حتى لو كانت كل التحديثات قراءة فقط
+        if self._sweep_task is None: self._sweep_task = asyncio.create_task(self._sweep_loop())
+        skey = self.key_builder.build(key)
+        now = time.time()
+        record = self._front.get(skey)
+        if record is not None and self.shared and skey not in self._dirty:
+            record = None
+            self._front.pop(skey, None)
+        if record is not None and now - record.updated_at > self.ttl:
+            record = None
+            self._front.pop(skey, None)
+        if record is None:
+            row = await self.db.load_fsm_state(skey, int(now - self.ttl))
+            # مستخدم بلا حالة: سجل فارغ بوقت التحميل، فلا يُعاد السؤال عنه قبل انتهاء ttl
+            record = _Record(row[0], json.loads(row[1]), row[2]) if row else _Record(updated_at=now)
+            # قراءة من القرص لا تغلب كتابة حدثت أثناء انتظارها
+            record = self._front.setdefault(skey, record)
+        return skey, record
+
+    async def _touch(self, skey: str, record: _Record):
+        record.updated_at = time.time()
+        self._dirty.add(skey)
+        if self.shared:
+            await self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._touch(skey, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key))[1].state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        skey, record = await self._record(key)
+        record.data = copy.copy(dict(data))
+        await self._touch(skey, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return copy.copy((await self._record(key))[1].data)
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        upserts, deletes = [], []
+        for skey in self._dirty:
+            record = self._front.get(skey)
+            if record is None: continue
+            if record.state is None and not record.data:
+                deletes.append(skey)
+                # جلسة منتهية لا داعي لإبقائها في الذاكرة
+                del self._front[skey]
+            else:
+                upserts.append((skey, record.state, json.dumps(record.data, ensure_ascii=False), int(record.updated_at)))
+        self._dirty.clear()
+        if upserts or deletes:
+            await self.db.save_fsm_states(upserts, deletes)
+            # العملية التالية التي تستقبل تحديث المستخدم يجب أن ترى الحالة فورًا
+            if self.shared: await self.db.flush()
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try: await self.sweep()
+            except Exception: logger.exception("fsm sweep failed")
+
+    async def sweep(self):
+        now = time.time()
+        for skey in [k for k, r in self._front.items() if now - r.updated_at > self.ttl and k not in self._dirty]:
+            del self._front[skey]
+        await self.db.purge_fsm_states(int(now - self.ttl))
+
+    async def close(self) -> None:
+        for task in (self._flush_task, self._sweep_task):
+            if task is not None: task.cancel()
+        self._flush_task = self._sweep_task = None
+        await self.flush()
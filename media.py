@@ -0,0 +1,84 @@
+import io
+import os
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+try:
+    from PIL import Image
+except ImportError:   # البطاقات المجمعة اختيارية وتتطلب Pillow
+    Image = None
+
+# أكبر مقاس يُعرض للمستخدم، ومقاس المصغرات المستخدمة في البطاقة المجمعة
+PHOTO_TARGET = 1280
+THUMB_TARGET = 320
+# send_media_group يقبل 10 عناصر كحد أقصى
+ALBUM_LIMIT = 10
+
+CARD_CELL = 400
+CARD_GAP = 8
+CARD_BACKGROUND = (24, 24, 32)
+
+
+def pick_size(sizes: Sequence, target: int):
+    # تيليجرام يرسل المقاسات من الأصغر للأكبر: نأخذ أكبر مقاس لا يتجاوز الهدف، وإلا الأصغر
+    fitting = [s for s in sizes if max(s.width, s.height) <= target]
+    return fitting[-1] if fitting else sizes[0]
+
+
+class ThumbnailCache:
+    # ملفات المصغرات على القرص بأسماء file_unique_id، وتُحذف الأقدم استخدامًا عند تجاوز الحجم
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        self._sizes: OrderedDict[str, int] = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self._total = sum(self._sizes.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        if key not in self._sizes: return None
+        try:
+            with open(self._path(key), 'rb') as f: data = f.read()
+        except FileNotFoundError:
+            self._total -= self._sizes.pop(key)
+            return None
+        self._sizes.move_to_end(key)
+        os.utime(self._path(key))
+        return data
+
+    def put(self, key: str, data: bytes):
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, 'wb') as f: f.write(data)
+        os.replace(tmp, self._path(key))
+        self._total += len(data) - self._sizes.pop(key, 0)
+        self._sizes[key] = len(data)
+        while self._total > self.max_bytes and len(self._sizes) > 1:
+            old, size = self._sizes.popitem(last=False)
+            self._total -= size
+            try: os.remove(self._path(old))
+            except FileNotFoundError: pass
+
+
+def build_card(images: Sequence[bytes]) -> bytes:
+    # شبكة من المصغرات (حتى 3 أعمدة) في صورة JPEG واحدة
+    columns = min(3, len(images))
+    rows = -(-len(images) // columns)
+    card = Image.new('RGB', (columns * CARD_CELL + (columns + 1) * CARD_GAP, rows * CARD_CELL + (rows + 1) * CARD_GAP),
+                     CARD_BACKGROUND)
+    for i, data in enumerate(images):
+        with Image.open(io.BytesIO(data)) as thumb:
+            thumb = thumb.convert('RGB')
+            thumb.thumbnail((CARD_CELL, CARD_CELL))
+            col, row = i % columns, i // columns
+            x = CARD_GAP + col * (CARD_CELL + CARD_GAP) + (CARD_CELL - thumb.width) // 2
+            y = CARD_GAP + row * (CARD_CELL + CARD_GAP) + (CARD_CELL - thumb.height) // 2
+            card.paste(thumb, (x, y))
+    out = io.BytesIO()
+    card.save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue()
@@ -0,0 +1,124 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from aiogram import BaseMiddleware
+
+# حدود المدرج التكراري بالثواني
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_str(names, values) -> str:
+    if not names: return ""
+    return "{" + ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_label_str(self.labels, key)} {value}"
+
+
+class Histogram:
+    # عدادات ثابتة لكل حد: التسجيل بحث ثنائي وزيادة واحدة، بلا تخزين للقيم
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.series: dict[tuple, list] = {}   # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, key: tuple) -> int:
+        return sum(self.series[key][:-1])
+
+    def quantile(self, q: float, key: tuple) -> float:
+        # تقدير من الحد الأعلى للدلو، يكفي لأمر /stats
+        series = self.series[key]
+        target, seen = q * self.count(key), 0
+        for bound, n in zip(self.buckets + (float('inf'),), series[:-1]):
+            seen += n
+            if seen >= target: return bound
+        return float('inf')
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += n
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{_label_str(self.labels + ('le',), key + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_label_str(self.labels, key)} {series[-1]}"
+            yield f"{self.name}_count{_label_str(self.labels, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: list[Callable[[], Iterable[str]]] = []
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = [line for metric in self.metrics for line in metric.render()]
+        for collect in self.collectors: lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram("sara_handler_seconds", "Handler latency", ("handler",))
+handler_errors = registry.counter("sara_handler_errors_total", "Handler exceptions", ("handler",))
+sql_seconds = registry.histogram("sara_sql_seconds", "Database operation latency", ("op",))
+sql_rows = registry.counter("sara_sql_rows_total", "Rows returned or changed", ("op",))
+alert_tick_seconds = registry.histogram("sara_alert_tick_seconds", "Alert batch duration")
+alerts_sent = registry.counter("sara_alerts_sent_total", "Alerts delivered", ("alert_type",))
+alert_send_failures = registry.counter("sara_alert_send_failures_total", "Alerts that failed after retries", ("alert_type",))
+gc_rows = registry.counter("sara_gc_rows_total", "Rows removed by the maintenance job", ("kind",))
+
+
+def observe_sql(op: str, seconds: float, result):
+    sql_seconds.observe(seconds, op=op)
+    if isinstance(result, (list, set, dict, tuple)): rows = len(result)
+    elif isinstance(result, int) and not isinstance(result, bool): rows = result
+    else: rows = getattr(result, 'rowcount', -1)
+    if rows and rows > 0: sql_rows.inc(rows, op=op)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    # middleware داخلي: يعمل بعد الفلاتر فيعرف اسم المعالج المختار
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, handler=name)
@@ -0,0 +1,85 @@
+import asyncio
+import random
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+# حدود تيليجرام: ~30 رسالة/ثانية إجمالًا، رسالة/ثانية للمحادثة الخاصة، 20 رسالة/دقيقة للمجموعة
+GLOBAL_RATE, GLOBAL_BURST = 30.0, 30
+PRIVATE_RATE, PRIVATE_BURST = 1.0, 1
+GROUP_RATE, GROUP_BURST = 20 / 60, 5
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class TokenBucket:
+    # GCRA: كل طلب يحجز موعدًا، فالمنتظرون يخرجون بالترتيب دون طابور منفصل
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0   # theoretical arrival time
+
+    def reserve(self, now: float) -> float:
+        tat = max(self.tat, now)
+        self.tat = tat + self.interval
+        return max(0.0, tat - self.tolerance - now)
+
+    def block_until(self, until: float):
+        self.tat = max(self.tat, until + self.tolerance)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    # يمر عليه كل طلب يخرج من جلسة البوت (ردود، تنبيهات، تعديلات)
+    def __init__(self):
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chats: dict[int, TokenBucket] = {}
+        self.retries = 0
+        self.failures = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000: self._prune()
+            bucket = TokenBucket(*((GROUP_RATE, GROUP_BURST) if chat_id < 0 else (PRIVATE_RATE, PRIVATE_BURST)))
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chats.items() if b.tat < now]: del self._chats[chat_id]
+
+    async def _acquire(self, chat_id):
+        if isinstance(chat_id, int):
+            delay = self._chat_bucket(chat_id).reserve(time.monotonic())
+            if delay: await asyncio.sleep(delay)
+        delay = self._global.reserve(time.monotonic())
+        if delay: await asyncio.sleep(delay)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None: return await make_request(bot, method)
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                # flood wait: نوقف المحادثة كلها حتى تنتهي المهلة ثم نعيد المحاولة
+                if attempt >= MAX_ATTEMPTS:
+                    self.failures += 1
+                    raise
+                self.retries += 1
+                until = time.monotonic() + e.retry_after
+                if isinstance(chat_id, int): self._chat_bucket(chat_id).block_until(until)
+                else: await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError):
+                if attempt >= MAX_ATTEMPTS:
+                    self.failures += 1
+                    raise
+                self.retries += 1
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
@@ -0,0 +1,63 @@
+import asyncio
+import importlib
+import re
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="module")
+def sara(tmp_path_factory):
+    # sara يفتح قاعدة البيانات في المجلد الحالي عند الاستيراد
+    mp = pytest.MonkeyPatch()
+    mp.chdir(tmp_path_factory.mktemp("db"))
+    mp.setenv("BOT_TOKEN", "123456:ABCdefGhIJKlmnoPQRstuVWxyz012345678")
+    mp.setenv("OWNER_ID", "1")
+    mp.setenv("TARGET_CHAT_ID", "0")
+    module = importlib.import_module("sara")
+    yield module
+    asyncio.run(module.db.close())
+    mp.undo()
+
+
+def _names(text):
+    return re.findall(r"\[(e\d+)\]", text)
+
+
+def _buttons(keyboard):
+    return {} if keyboard is None else {b.text: b.callback_data for b in keyboard.inline_keyboard[0]}
+
+
+def test_prev_pages_mirror_next_pages(sara):
+    async def run():
+        now = int(time.time())
+        # أوصاف تطول تدريجيًا فتمتلئ الرسالة قبل 10 أحداث في الصفحات الأخيرة
+        events = [(f"e{i}", now + 3600 * (i + 1), "x" * (30 * i)) for i in range(45)]
+        await sara.db.bulk_import(0, [], events)
+        sara.cache.invalidate_all()
+
+        forward = []
+        text, keyboard = await sara.events_page(0)
+        while True:
+            forward.append(_names(text))
+            data = _buttons(keyboard).get("التالي ▶️")
+            if data is None: break
+            text, keyboard = await sara.events_page(0, sara.EventsPage.unpack(data))
+
+        backward = []
+        while True:
+            data = _buttons(keyboard).get("◀️ السابق")
+            if data is None: break
+            text, keyboard = await sara.events_page(0, sara.EventsPage.unpack(data))
+            backward.append(_names(text))
+        return forward, backward
+
+    forward, backward = asyncio.run(run())
+    seen = [name for page in forward for name in page]
+    assert seen == [f"e{i}" for i in range(45)]
+    # الرجوع يمر على كل الأحداث السابقة للصفحة الأخيرة بلا فجوات
+    assert [name for page in reversed(backward) for name in page] == seen[:-len(forward[-1])]
@@ -0,0 +1,198 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+SERVERS = ('asia', 'europe', 'america')
+
+# تحولات التوقيت الصيفي تقع على حدود ربع ساعة، فالإزاحة ثابتة داخل كل ربع ساعة
+_BUCKET = 900
+_MEMO_LIMIT = 4096
+
+
+@lru_cache(maxsize=4096)
+def _days_from_civil(y: int, m: int, d: int) -> int:
+    # عدد الأيام منذ 1970-01-01 دون المرور بـ datetime
+    y -= m <= 2
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m - 3 if m > 2 else m + 9) + 2) // 5 + d - 1
+    return era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+
+
+def _civil_from_days(z: int) -> tuple[int, int, int]:
+    z += 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (m <= 2), m, d
+
+
+def _month_days(y: int, m: int) -> int:
+    if m == 2: return 29 if y % 4 == 0 and (y % 100 != 0 or y % 400 == 0) else 28
+    return 30 if m in (4, 6, 9, 11) else 31
+
+
+@lru_cache(maxsize=1024)
+def parse_wall(text: str) -> Optional[int]:
+    # "YYYY-MM-DD HH:MM:SS" -> ثوانٍ كأن الوقت بتوقيت UTC، بلا strptime في الحالة المعتادة
+    if len(text) == 19 and text[4] == text[7] == '-' and text[10] == ' ' and text[13] == text[16] == ':':
+        digits = text[:4] + text[5:7] + text[8:10] + text[11:13] + text[14:16] + text[17:]
+        if not digits.isdecimal(): return None
+        # int واحد للأرقام كلها ثم قسمة، أسرع من ستة int على شرائح
+        n, s = divmod(int(digits), 100)
+        n, mi = divmod(n, 100)
+        n, h = divmod(n, 100)
+        n, d = divmod(n, 100)
+        y, mo = divmod(n, 100)
+        if not (1 <= mo <= 12 and 1 <= d <= _month_days(y, mo) and h < 24 and mi < 60 and s < 60 and y >= 1): return None
+        return _days_from_civil(y, mo, d) * 86400 + h * 3600 + mi * 60 + s
+    # strptime يقبل أيضًا أرقامًا بلا أصفار بادئة ("2025-1-5 3:04:05")
+    try: parsed = datetime.strptime(text, TIME_FORMAT)
+    except ValueError: return None
+    return int(parsed.replace(tzinfo=timezone.utc).timestamp())
+
+
+class Zone:
+    # إزاحة ثابتة بالساعات، أو منطقة IANA بتوقيتها الصيفي إن حُدد اسمها
+    __slots__ = ('offset_hours', 'name', '_tz', '_to_utc', '_to_local')
+
+    def __init__(self, offset_hours: int = 0, name: Optional[str] = None):
+        self.offset_hours = offset_hours
+        self.name = name
+        self._tz = ZoneInfo(name) if name else None
+        self._to_utc: dict[int, int] = {}
+        self._to_local: dict[int, int] = {}
+
+    def label(self) -> str:
+        return self.name or f"UTC{self.offset_hours:+d}"
+
+    def to_utc(self, wall: int) -> int:
+        if self._tz is None: return wall - self.offset_hours * 3600
+        bucket = wall // _BUCKET
+        offset = self._to_utc.get(bucket)
+        if offset is None:
+            # fold=0: الوقت المكرر عند الرجوع للتوقيت الشتوي يُقرأ بالإزاحة الأولى
+            local = datetime.fromtimestamp(bucket * _BUCKET, timezone.utc).replace(tzinfo=self._tz)
+            offset = int(local.utcoffset().total_seconds())
+            if len(self._to_utc) > _MEMO_LIMIT: self._to_utc.clear()
+            self._to_utc[bucket] = offset
+        return wall - offset
+
+    def to_local(self, ts: int) -> int:
+        if self._tz is None: return ts + self.offset_hours * 3600
+        bucket = ts // _BUCKET
+        offset = self._to_local.get(bucket)
+        if offset is None:
+            offset = int(datetime.fromtimestamp(bucket * _BUCKET, self._tz).utcoffset().total_seconds())
+            if len(self._to_local) > _MEMO_LIMIT: self._to_local.clear()
+            self._to_local[bucket] = offset
+        return ts + offset
+
+
+def parse_local(text: str, zone: Zone) -> Optional[int]:
+    # وقت السيرفر المحلي -> epoch بتوقيت UTC، أو None إن كان النص خاطئًا
+    wall = parse_wall(text.strip())
+    return zone.to_utc(wall) if wall is not None else None
+
+
+def format_local(ts: int, zone: Zone) -> str:
+    wall = zone.to_local(ts)
+    days, secs = divmod(wall, 86400)
+    y, m, d = _civil_from_days(days)
+    return f"{y:04d}-{m:02d}-{d:02d} {secs // 3600:02d}:{secs % 3600 // 60:02d}:{secs % 60:02d}"
+
+
+# --- Countdowns ---
+
+@lru_cache(maxsize=4096)
+def _left_text(days: int, hours: int) -> str:
+    return f"{days}يوم و {hours}ساعة"
+
+
+def time_left(end_ts: float, now_ts: float) -> str:
+    seconds = int(end_ts - now_ts)
+    if seconds <= 0: return "منتهي"
+    return _left_text(seconds // 86400, seconds % 86400 // 3600)
+
+
+def time_left_many(end_times: Iterable[Optional[float]], now_ts: float) -> list[Optional[str]]:
+    # دفعة كاملة في حلقة واحدة: None لوقت غير محدد
+    out = []
+    for end_ts in end_times:
+        if end_ts is None:
+            out.append(None)
+            continue
+        seconds = int(end_ts - now_ts)
+        out.append(_left_text(seconds // 86400, seconds % 86400 // 3600) if seconds > 0 else "منتهي")
+    return out
+
+
+def time_left_rows(rows: Sequence, now_ts: float) -> list[tuple[Optional[str], Optional[str], Optional[str]]]:
+    # N صف × 3 سيرفرات (end_time_asia/europe/america)
+    flat = time_left_many((t for row in rows for t in (row.end_time_asia, row.end_time_europe, row.end_time_america)), now_ts)
+    return [tuple(flat[i:i + 3]) for i in range(0, len(flat), 3)]
+
+
+def next_change(end_times: Iterable[Optional[float]], now_ts: float) -> float:
+    # العد التنازلي بدقة الساعة: النص ثابت حتى عبور أقرب حد ساعة لأي وقت انتهاء
+    remaining = (end_ts - now_ts for end_ts in end_times if end_ts is not None)
+    return now_ts + min((r % 3600 for r in remaining if r > 0), default=float('inf'))
+
+
+# --- Recurrence rules ---
+# "monthly 1,16 04:00"          كل 1 و16 من الشهر الساعة 04:00 بتوقيت السيرفر
+# "every 21d 2025-01-01 04:00"  كل 21 يومًا بدءًا من هذا الموعد بتوقيت السيرفر
+
+class Rule(NamedTuple):
+    kind: str                 # 'monthly' أو 'every'
+    days: tuple[int, ...]     # أيام الشهر (monthly)
+    period: int               # بالثواني (every)
+    anchor: int               # وقت البداية كثوانٍ محلية (every)
+    time_of_day: int          # بالثواني (monthly)
+
+
+def _parse_hhmm(text: str) -> int:
+    hours, minutes = text.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60): raise ValueError(text)
+    return hours * 3600 + minutes * 60
+
+
+@lru_cache(maxsize=256)
+def parse_rule(text: str) -> Rule:
+    parts = text.lower().split()
+    if len(parts) == 3 and parts[0] == 'monthly':
+        days = tuple(sorted({int(d) for d in parts[1].split(',')}))
+        if not days or not all(1 <= d <= 31 for d in days): raise ValueError(text)
+        return Rule('monthly', days, 0, 0, _parse_hhmm(parts[2]))
+    if len(parts) == 4 and parts[0] == 'every' and parts[1].endswith('d'):
+        period = int(parts[1][:-1])
+        anchor = parse_wall(f"{parts[2]} {parts[3]}:00" if parts[3].count(':') == 1 else f"{parts[2]} {parts[3]}")
+        if period < 1 or anchor is None: raise ValueError(text)
+        return Rule('every', (), period * 86400, anchor, 0)
+    raise ValueError(text)
+
+
+def next_occurrence(rule: Rule, zone: Zone, after_ts: int) -> int:
+    # أول موعد بعد after_ts، محسوب بالوقت المحلي للسيرفر ثم محول إلى UTC (يراعي التوقيت الصيفي)
+    wall = zone.to_local(after_ts)
+    if rule.kind == 'every':
+        k = max(0, (wall - rule.anchor) // rule.period)
+        while True:
+            ts = zone.to_utc(rule.anchor + k * rule.period)
+            if ts > after_ts: return ts
+            k += 1
+    y, m, _ = _civil_from_days(wall // 86400)
+    for _ in range(14):
+        for day in rule.days:
+            if day > _month_days(y, m): continue
+            ts = zone.to_utc(_days_from_civil(y, m, day) * 86400 + rule.time_of_day)
+            if ts > after_ts: return ts
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    raise ValueError(rule)